@@ -1,11 +1,251 @@
 #!/usr/bin/env python3
 
+import atexit
+import av
 import cv2
 import csv
+import json
 import sys
 import os
-import pandas as pd
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from frame_reader import FrameReader
+
+# Starting estimate of how long an exact frame read takes; keypresses arriving faster
+# than the measured read time are treated as scrubbing (held-down key)
+SCRUB_INTERVAL_S = 0.15
+# Weight of the newest measurement in the running read-time estimate
+DECODE_TIME_SMOOTHING = 0.2
+# How long to wait after a scrubbing keypress before decoding the exact frame
+SCRUB_IDLE_MS = 150
+# Frames either side of an attempt that navigation is allowed to reach
+NAV_MARGIN = 30
+# Upper bound on the memory used by the preloaded navigation windows, covering both the
+# attempt on screen and the prefetched next one (the reader's frame cache is separate)
+WINDOW_BUFFER_BYTES = 1 << 30
+
+# Columns the classifier adds to the attempt table
+RESULT_COLUMNS = ['ground_truth_block_drop', 'is_flagged', 'reason_for_flag']
+
+# Vertical layout of the on-frame text panel
+LIMIT_Y_POS = 90
+CLASSIFY_Y_POS = LIMIT_Y_POS + 30
+CUSTOM_INPUT_Y_POS = 130
+
+# Key codes, resolved once instead of calling ord() on every comparison
+KEY_Q, KEY_U, KEY_I, KEY_T = map(ord, 'quit')
+KEY_0, KEY_1, KEY_2 = map(ord, '012')
+KEY_ESCAPE = 27
+KEY_ENTER = 13
+PRINTABLE_KEYS = frozenset(range(32, 127))
+
+# Navigation keys and the number of frames they move by
+NAV_STEPS = {ord('j'): -1, ord('k'): 1, ord('h'): -10, ord('l'): 10}
+
+# Classification keys and the ground_truth_block_drop value and description they record
+CLASSIFY_CHOICES = {
+    KEY_0: (0, "block did not fall"),
+    KEY_1: (1, "block fell"),
+}
+
+# Flag menu keys and the (ground_truth_block_drop, reason_for_flag) they record
+FLAG_CHOICES = {
+    ord('w'): (2, "Block transferred, but failure because the fingers did not cross"),
+    ord('e'): (3, "Block transferred, but fingers might not have crossed"),
+    ord('r'): (4, "Needs manual review"),
+}
+
+FLAG_OPTIONS = [
+    "Flag Options:",
+    "w: Block transferred, fingers did not cross",
+    "e: Block transferred, fingers might not have crossed",
+    "r: Needs manual review",
+    "t: Custom reason (type your own)",
+    "2: Back to main menu"
+]
+
+
+@lru_cache(maxsize=256)
+def text_size(text, font_scale):
+    """
+    Memoized cv2.getTextSize for the panel font; the same strings are measured on every redraw.
+    """
+    return cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 2)
+
+
+def draw_text_box(image, text, y_pos, font_scale, padding, background_color, text_color):
+    """
+    Draws text at (10, y_pos) on a filled background box.
+    Returns the box corners so callers can reuse the covered area.
+    """
+    (text_width, text_height), baseline = text_size(text, font_scale)
+    top_left = (10, y_pos - text_height - padding)
+    bottom_right = (10 + text_width + 5, y_pos + baseline + padding)
+    cv2.rectangle(image, top_left, bottom_right, background_color, -1)
+    cv2.putText(image, text, (10, y_pos), cv2.FONT_HERSHEY_SIMPLEX, font_scale, text_color, 2)
+    return top_left, bottom_right
+
+
+def build_text_overlay(text_boxes):
+    """
+    Renders text boxes once into an overlay anchored at the top-left of the frame.
+
+    Args:
+        text_boxes (list): (text, y_pos, font_scale, padding, background_color, text_color) tuples.
+
+    Returns:
+        tuple: (overlay, boxes) to be composited with paste_overlay(), where boxes are
+        the (top, bottom, left, right) slice bounds of each background box.
+    """
+    height, width = 1, 1
+    for text, y_pos, font_scale, padding, _, _ in text_boxes:
+        (text_width, text_height), baseline = text_size(text, font_scale)
+        height = max(height, y_pos + baseline + padding + 1)
+        width = max(width, 10 + text_width + 5 + 1)
+
+    overlay = np.zeros((height, width, 3), dtype=np.uint8)
+    boxes = []
+    for text_box in text_boxes:
+        (left, top), (right, bottom) = draw_text_box(overlay, *text_box)
+        # Filled rectangles include both corners
+        boxes.append((max(top, 0), bottom + 1, left, right + 1))
+
+    return overlay, boxes
+
+
+def paste_overlay(frame, overlay, boxes):
+    """
+    Copies the overlay's text boxes onto the top-left corner of the frame in place.
+    Each box fully covers its text, so plain slice copies replace a per-pixel mask.
+    """
+    frame_height, frame_width = frame.shape[:2]
+    for top, bottom, left, right in boxes:
+        bottom = min(bottom, frame_height)
+        right = min(right, frame_width)
+        frame[top:bottom, left:right] = overlay[top:bottom, left:right]
+
+
+@lru_cache(maxsize=256)
+def info_overlay(info_text):
+    """
+    Rendered frame/time line, cached so scrubbing back over a frame reuses its pixels.
+    """
+    return build_text_overlay([(info_text, 30, 0.7, 5, (0, 255, 0), (0, 0, 0))])
+
+
+def navigation_limits(start_frame, end_frame, total_frames):
+    """
+    Returns the (rewind_limit, forward_limit) frames navigation is locked to for an attempt.
+    """
+    return max(0, start_frame - NAV_MARGIN), min(total_frames - 1, end_frame + NAV_MARGIN)
+
+
+def read_attempts(csv_file):
+    """
+    Reads the attempt table written by attempt_labeler.py.
+
+    Returns:
+        tuple: (fieldnames, attempts, start_frames, end_frames) where attempts is a list
+        of row dicts and the frame columns are int64 arrays.
+    """
+    with open(csv_file, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        fieldnames = list(reader.fieldnames or [])
+        for col in ['attempt_start_frame', 'attempt_end_frame']:
+            if col not in fieldnames:
+                raise KeyError(f"Required column '{col}' not found in CSV")
+        attempts = list(reader)
+
+    # Frames may have been written as floats (e.g. "45.0") by older output files
+    start_frames = np.array([int(float(row['attempt_start_frame'])) for row in attempts], dtype=np.int64)
+    end_frames = np.array([int(float(row['attempt_end_frame'])) for row in attempts], dtype=np.int64)
+    return fieldnames, attempts, start_frames, end_frames
+
+
+def load_classifications(start_frames, end_frames, output_csv, checkpoint_path):
+    """
+    Restores classifications from a previous session so a relaunch can resume.
+    Rows from an existing output CSV are applied first, then the checkpoint log
+    (which may hold attempts classified after the CSV was last written).
+    Entries are matched to attempts by their start/end frames. Output rows missing the
+    result columns (e.g. from an older output file) count as unclassified, and rows that
+    match no current attempt are returned unchanged so the next write keeps them.
+
+    Returns:
+        tuple: (ground_truth_values, flag_values, flag_reasons, extra_rows), with -1 marking
+        attempts that have not been classified.
+    """
+    ground_truth_values = np.full(len(start_frames), -1, np.int8)
+    flag_values = np.zeros(len(start_frames), np.int8)
+    flag_reasons = [""] * len(start_frames)
+    extra_rows = []
+
+    attempt_lookup = {
+        (start_frame, end_frame): index
+        for index, (start_frame, end_frame) in enumerate(zip(start_frames.tolist(), end_frames.tolist()))
+    }
+
+    def attempt_index(entry):
+        try:
+            return attempt_lookup.get((int(float(entry['attempt_start_frame'])), int(float(entry['attempt_end_frame']))))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    entries = []
+    if os.path.exists(output_csv):
+        with open(output_csv, 'r', newline='') as f:
+            for row in csv.DictReader(f):
+                index = attempt_index(row)
+                if index is None:
+                    extra_rows.append(row)
+                else:
+                    entries.append((index, row.get('ground_truth_block_drop') or '',
+                                    row.get('is_flagged') or '', row.get('reason_for_flag') or ''))
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Line cut short by a crash
+                index = attempt_index(entry)
+                if index is not None:
+                    entries.append((index, entry['ground_truth_block_drop'], entry['is_flagged'], entry['reason_for_flag']))
+
+    # Later entries win, so re-classified attempts keep their latest label
+    for index, ground_truth, is_flagged, reason_for_flag in entries:
+        if ground_truth == '':
+            continue  # Not classified yet
+        ground_truth_values[index] = int(float(ground_truth))
+        flag_values[index] = int(float(is_flagged or 0))
+        flag_reasons[index] = reason_for_flag or ""
+
+    return ground_truth_values, flag_values, flag_reasons, extra_rows
+
+
+def write_classifications(fieldnames, attempts, output_csv, ground_truth_values, flag_values, flag_reasons, extra_rows):
+    """
+    Writes every classified attempt to the output CSV in one pass, followed by the
+    rows of the previous output that match no current attempt.
+    The file is written to a temp path and moved into place, so a crash mid-write
+    never leaves a truncated CSV behind once the checkpoint log is gone.
+    """
+    output_fieldnames = fieldnames + [col for col in RESULT_COLUMNS if col not in fieldnames]
+    tmp_file = output_csv + '.tmp'
+    with open(tmp_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=output_fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(
+            {**row, 'ground_truth_block_drop': int(ground_truth), 'is_flagged': int(is_flagged), 'reason_for_flag': reason}
+            for row, ground_truth, is_flagged, reason in zip(attempts, ground_truth_values, flag_values, flag_reasons)
+            if ground_truth >= 0
+        )
+        writer.writerows(extra_rows)
+    os.replace(tmp_file, output_csv)
+
 
 def main():
     if len(sys.argv) != 3:
@@ -19,39 +259,40 @@ def main():
     if not os.path.exists(csv_file):
         print(f"Error: CSV file '{csv_file}' not found.")
         sys.exit(1)
+    if not os.path.exists(video_path):
+        print(f"Error: Video file '{video_path}' not found.")
+        sys.exit(1)
     
     
     # Create output CSV filename
-    csv_name = os.path.splitext(os.path.basename(csv_file))[0]
+    csv_name = Path(csv_file).stem
     output_csv = f"./outputs/attempt_classifications/{csv_name}_ground_truth.csv"
+    checkpoint_path = f"./outputs/attempt_classifications/{csv_name}_ground_truth_checkpoint.jsonl"
+    os.makedirs(os.path.dirname(output_csv), exist_ok=True) # Ensure output directory exists
     
-    # Read the input CSV
+    # Read the input CSV (frame columns are parsed into int arrays once, up front)
     try:
-        df = pd.read_csv(csv_file)
-        # Convert frame columns to integers
-        df['attempt_start_frame'] = df['attempt_start_frame'].astype(int)
-        df['attempt_end_frame'] = df['attempt_end_frame'].astype(int)
-        print(f"Loaded {len(df)} attempts from {csv_file}")
+        fieldnames, attempts, start_frames, end_frames = read_attempts(csv_file)
+        print(f"Loaded {len(attempts)} attempts from {csv_file}")
+    except KeyError as e:
+        print(f"Error: {e.args[0]}")
+        sys.exit(1)
     except Exception as e:
         print(f"Error reading CSV file: {e}")
         sys.exit(1)
     
-    # Validate required columns
-    required_columns = ['attempt_start_frame', 'attempt_end_frame']
-    for col in required_columns:
-        if col not in df.columns:
-            print(f"Error: Required column '{col}' not found in CSV")
-            sys.exit(1)
-    
-    # Open video file
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
+    # Open video file. The next attempt's window is decoded on a worker thread with its
+    # own reader, since decoders are not thread-safe.
+    try:
+        reader = FrameReader(video_path)
+        prefetch_reader = FrameReader(video_path)
+    except (av.error.FFmpegError, IndexError, ValueError):
         print(f"Error: Could not open video file '{video_path}'")
         sys.exit(1)
     
     # Get video properties
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = reader.fps
+    total_frames = reader.total_frames
     
     print(f"Video loaded: {video_path}")
     print(f"FPS: {fps}, Total frames: {total_frames}")
@@ -69,43 +310,106 @@ def main():
     print("- Press 'q' to quit (progress will be saved)")
     print("\nStarting classification...")
     
-    # Create output CSV with headers if it doesn't exist
-    output_columns = list(df.columns)
-    # Update the ground_truth_block_drop column or add it if it doesn't exist
-    if 'ground_truth_block_drop' not in output_columns:
-        output_columns.append('ground_truth_block_drop')
-    # Add flag columns if they don't exist
-    if 'is_flagged' not in output_columns:
-        output_columns.append('is_flagged')
-    if 'reason_for_flag' not in output_columns:
-        output_columns.append('reason_for_flag')
+    start_times = start_frames / fps
+    end_times = end_frames / fps
+    
+    # Classification results, indexed like the attempt table. The output CSV is written
+    # in one go on quit/finish; each classification is also appended to a small
+    # checkpoint log so nothing is lost if the script dies in between. The log is
+    # removed once the CSV is written, so it only survives a crash.
+    ground_truth_values, flag_values, flag_reasons, extra_rows = load_classifications(start_frames, end_frames, output_csv, checkpoint_path)
+    checkpoint_file = open(checkpoint_path, 'a', buffering=1)
+    atexit.register(checkpoint_file.close)
     
-    if not os.path.exists(output_csv):
-        with open(output_csv, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(output_columns)
+    # Menu overlays never change, so render them once up front
+    flag_menu_overlay = build_text_overlay([
+        (option, CLASSIFY_Y_POS + 30 + (i * 25), 0.5, 3, (0, 255, 255), (0, 0, 0))
+        for i, option in enumerate(FLAG_OPTIONS)
+    ])
+    custom_input_overlay = build_text_overlay([
+        ("Type custom reason for flagging:", CUSTOM_INPUT_Y_POS, 0.6, 5, (0, 0, 255), (255, 255, 255)),
+        ("Press Enter to submit | Press Esc to cancel", CUSTOM_INPUT_Y_POS + 65, 0.5, 3, (0, 0, 255), (255, 255, 255)),
+    ])
     
-    # Process each attempt
-    current_attempt_index = 0
+    # Process each attempt, resuming at the first one not yet classified
+    unclassified = np.flatnonzero(ground_truth_values < 0)
+    current_attempt_index = int(unclassified[0]) if len(unclassified) else 0
+    if len(attempts) and not len(unclassified):
+        # Everything is done; go through the attempts again so they can be reviewed
+        print(f"All {len(attempts)} attempts are already classified. Starting review at attempt 1")
+    elif current_attempt_index > 0:
+        print(f"Resuming at attempt {current_attempt_index + 1} ({len(attempts) - len(unclassified)} already classified)")
+    last_key_time = 0.0
+    key_interval = float('inf')
+    exact_read_s = SCRUB_INTERVAL_S  # running estimate of an exact (non-keyframe) read
     
-    while current_attempt_index < len(df):
+    # The next attempt's window is decoded while the current attempt is on screen
+    prefetch_executor = ThreadPoolExecutor(max_workers=1)
+    prefetch_limits, prefetch = None, None
+    
+    # Number of frames an attempt's preloaded window may hold; the budget is split
+    # between the two window buffers below
+    window_frames = max(1, WINDOW_BUFFER_BYTES // (2 * reader.height * reader.width * 3))
+    
+    # Two window buffers sized for the longest attempt are reused for the whole session:
+    # one holds the attempt on screen while the other receives the prefetched next attempt.
+    # The displayed frame is copied into a single reusable buffer (imshow copies it anyway).
+    if len(attempts):
+        longest_window = int(np.max(np.minimum(end_frames + NAV_MARGIN, total_frames - 1) - np.maximum(start_frames - NAV_MARGIN, 0))) + 1
+        window_frames = max(1, min(window_frames, longest_window))
+    window_buffers = [np.empty((window_frames, reader.height, reader.width, 3), dtype=np.uint8) for _ in range(2)]
+    active_buffer = 0
+    display_frame = np.empty((reader.height, reader.width, 3), dtype=np.uint8)
+    
+    while current_attempt_index < len(attempts):
         index = current_attempt_index
-        row = df.iloc[index]
-        
         attempt_num = index + 1  # Use row index + 1 as attempt number
-        start_frame = int(row['attempt_start_frame'])
-        end_frame = int(row['attempt_end_frame'])
-        start_time = start_frame / fps
-        end_time = end_frame / fps
+        start_frame = int(start_frames[index])
+        end_frame = int(end_frames[index])
+        start_time = start_times[index]
+        end_time = end_times[index]
         
         # --- MODIFICATION START ---
         # Define the navigation boundaries for the current attempt (+/- 30 frames)
-        rewind_limit = max(0, start_frame - 30)
-        forward_limit = min(total_frames - 1, end_frame + 30)
+        rewind_limit, forward_limit = navigation_limits(start_frame, end_frame, total_frames)
         # --- MODIFICATION END ---
         
+        range_text = f"Range: {start_frame}-{end_frame} | j/k: -/+1 | h/l: -/+10 | u/i: prev/next"
+        limit_text = f"Nav Locked to: {rewind_limit}-{forward_limit} (+/- 30 frames)"
+        classify_text = "Press 0 (no drop) | 1 (drop) | 2 (flag) | q (quit)"
+        attempt_overlay = build_text_overlay([
+            (range_text, 60, 0.6, 5, (255, 255, 255), (0, 0, 0)),
+            (limit_text, LIMIT_Y_POS, 0.6, 5, (0, 255, 255), (0, 0, 0)),
+            (classify_text, CLASSIFY_Y_POS, 0.6, 5, (255, 255, 255), (0, 0, 0)),
+        ])
+        
         print(f"\n--- Classifying Attempt {attempt_num} ---")
         print(f"Frames {start_frame} to {end_frame} ({start_time:.2f}s to {end_time:.2f}s)")
+        
+        # Decode the navigation window up front so j/k/h/l are plain array lookups.
+        # If the window is larger than the memory budget only its start is preloaded;
+        # frames past that are decoded on demand.
+        window_limits = (rewind_limit, min(forward_limit, rewind_limit + window_frames - 1))
+        try:
+            if prefetch is not None and prefetch_limits == window_limits:
+                active_buffer = 1 - active_buffer
+                window, window_count = prefetch.result()
+            else:
+                window, window_count = reader.read_window(*window_limits, window_buffers[active_buffer])
+        except av.error.FFmpegError as e:
+            # Nothing preloaded; frames are decoded on demand instead
+            print(f"Warning: Could not preload frames {window_limits[0]} to {window_limits[1]}: {e}")
+            window, window_count = window_buffers[active_buffer], 0
+        
+        # Start decoding the next attempt's window in the background
+        if prefetch is not None:
+            prefetch.cancel()
+        prefetch_limits, prefetch = None, None
+        if index + 1 < len(attempts):
+            next_rewind, next_forward = navigation_limits(int(start_frames[index + 1]), int(end_frames[index + 1]), total_frames)
+            prefetch_limits = (next_rewind, min(next_forward, next_rewind + window_frames - 1))
+            prefetch = prefetch_executor.submit(prefetch_reader.read_window, *prefetch_limits, window_buffers[1 - active_buffer])
+        
         print("Use j/k to navigate, then 0/1/2 to classify...")
         
         classified = False
@@ -115,7 +419,7 @@ def main():
         current_frame = start_frame  # Start at the beginning of the attempt
         flag_menu_active = False
         custom_input_mode = False
-        custom_text = ""
+        custom_chars = []
         
         while not classified:
             # --- MODIFICATION START ---
@@ -124,9 +428,27 @@ def main():
             current_frame = max(rewind_limit, min(current_frame, forward_limit))
             # --- MODIFICATION END ---
             
-            # Set video position to current frame
-            cap.set(cv2.CAP_PROP_POS_FRAMES, current_frame)
-            ret, frame = cap.read()
+            if current_frame - rewind_limit < window_count:
+                np.copyto(display_frame, window[current_frame - rewind_limit])
+                ret, frame = True, display_frame
+                approximate = False
+            else:
+                # Decode the current frame (sequential for +1 steps, keyframe seek otherwise).
+                # While a key is held down, snap to the keyframe to keep up with the key repeat.
+                scrubbing = key_interval < exact_read_s
+                decoded = not reader.is_decoded(current_frame)
+                read_start = time.perf_counter()
+                try:
+                    ret, frame = reader.read(current_frame, exact=not scrubbing)
+                except av.error.FFmpegError as e:
+                    print(f"Warning: {e}")
+                    ret, frame = False, None
+                approximate = reader.last_index != current_frame
+                if not scrubbing and decoded:
+                    # Only snap to keyframes when exact reads can't keep up with the keypresses
+                    # (cache hits are near-instant and would drag the estimate down)
+                    read_s = time.perf_counter() - read_start
+                    exact_read_s += DECODE_TIME_SMOOTHING * (read_s - exact_read_s)
             
             if not ret:
                 print(f"Warning: Could not read frame {current_frame}")
@@ -138,190 +460,142 @@ def main():
             
             # Display info on frame with white background
             info_text = f"Attempt {attempt_num} | Frame: {current_frame} | Time: {current_time:.2f}s"
-            (text_width, text_height), baseline = cv2.getTextSize(info_text, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
-            cv2.rectangle(frame, (10, 30 - text_height - 5), (10 + text_width + 5, 30 + baseline + 5), (0, 255, 0), -1)
-            cv2.putText(frame, info_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
-            
-            # Show frame range info and controls
-            range_text = f"Range: {start_frame}-{end_frame} | j/k: -/+1 | h/l: -/+10 | u/i: prev/next"
-            (text_width, text_height), baseline = cv2.getTextSize(range_text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-            cv2.rectangle(frame, (10, 60 - text_height - 5), (10 + text_width + 5, 60 + baseline + 5), (255, 255, 255), -1)
-            cv2.putText(frame, range_text, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
+            if approximate:
+                info_text += " (keyframe)"
+            paste_overlay(frame, *info_overlay(info_text))
             
-            # --- MODIFICATION START ---
-            # Show navigation limit text
-            limit_y_pos = 90
-            limit_text = f"Nav Locked to: {rewind_limit}-{forward_limit} (+/- 30 frames)"
-            (text_width, text_height), baseline = cv2.getTextSize(limit_text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-            cv2.rectangle(frame, (10, limit_y_pos - text_height - 5), (10 + text_width + 5, limit_y_pos + baseline + 5), (0, 255, 255), -1)
-            cv2.putText(frame, limit_text, (10, limit_y_pos), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
-            
-            # Adjust position of the next text block
-            classify_y_pos = limit_y_pos + 30
-            # --- MODIFICATION END ---
-            
-            classify_text = f"Press 0 (no drop) | 1 (drop) | 2 (flag) | q (quit)"
-            (text_width, text_height), baseline = cv2.getTextSize(classify_text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-            cv2.rectangle(frame, (10, classify_y_pos - text_height - 5), (10 + text_width + 5, classify_y_pos + baseline + 5), (255, 255, 255), -1)
-            cv2.putText(frame, classify_text, (10, classify_y_pos), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
+            # Range, navigation limit and classify controls are fixed for the attempt
+            paste_overlay(frame, *attempt_overlay)
             
             # Show flag menu if active
             if flag_menu_active and not custom_input_mode:
-                flag_options = [
-                    "Flag Options:",
-                    "w: Block transferred, fingers did not cross",
-                    "e: Block transferred, fingers might not have crossed", 
-                    "r: Needs manual review",
-                    "t: Custom reason (type your own)",
-                    "2: Back to main menu"
-                ]
-                
-                y_start = classify_y_pos + 30
-                for i, option in enumerate(flag_options):
-                    y_pos = y_start + (i * 25)
-                    (text_width, text_height), baseline = cv2.getTextSize(option, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
-                    cv2.rectangle(frame, (10, y_pos - text_height - 3), (10 + text_width + 5, y_pos + baseline + 3), (0, 255, 255), -1)
-                    cv2.putText(frame, option, (10, y_pos), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
+                paste_overlay(frame, *flag_menu_overlay)
             
             # Show custom input interface if in custom input mode
             if custom_input_mode:
-                prompt_text = "Type custom reason for flagging:"
-                y_pos = 130
-                (text_width, text_height), baseline = cv2.getTextSize(prompt_text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
-                cv2.rectangle(frame, (10, y_pos - text_height - 5), (10 + text_width + 5, y_pos + baseline + 5), (0, 0, 255), -1)
-                cv2.putText(frame, prompt_text, (10, y_pos), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+                paste_overlay(frame, *custom_input_overlay)
                 
-                input_display = f"Input: {custom_text}|"
-                y_pos2 = y_pos + 35
-                (text_width2, text_height2), baseline2 = cv2.getTextSize(input_display, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
-                cv2.rectangle(frame, (10, y_pos2 - text_height2 - 3), (10 + text_width2 + 5, y_pos2 + baseline2 + 3), (255, 255, 255), -1)
-                cv2.putText(frame, input_display, (10, y_pos2), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 2)
-                
-                instruction_text = "Press Enter to submit | Press Esc to cancel"
-                y_pos3 = y_pos2 + 30
-                (text_width3, text_height3), baseline3 = cv2.getTextSize(instruction_text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
-                cv2.rectangle(frame, (10, y_pos3 - text_height3 - 3), (10 + text_width3 + 5, y_pos3 + baseline3 + 3), (0, 0, 255), -1)
-                cv2.putText(frame, instruction_text, (10, y_pos3), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
+                input_display = f"Input: {''.join(custom_chars)}|"
+                draw_text_box(frame, input_display, CUSTOM_INPUT_Y_POS + 35, 0.5, 3, (255, 255, 255), (0, 0, 0))
             
             cv2.imshow('Attempt Classifier', frame)
             
-            key = cv2.waitKey(0) & 0xFF
+            # If a keyframe was shown instead of the exact frame, time out once the
+            # user stops scrubbing so the loop can redraw the exact frame
+            key = cv2.waitKey(SCRUB_IDLE_MS if approximate else 0) & 0xFF
+            
+            if key == 0xFF:  # waitKey timed out
+                key_interval = float('inf')
+                continue
+            
+            now = time.perf_counter()
+            key_interval = now - last_key_time
+            last_key_time = now
             
-            if key == ord('q') and not flag_menu_active:
+            if key == KEY_Q and not flag_menu_active:
                 print("Quitting...")
-                cap.release()
+                write_classifications(fieldnames, attempts, output_csv, ground_truth_values, flag_values, flag_reasons, extra_rows)
+                # Everything in the log is now in the CSV
+                checkpoint_file.close()
+                os.remove(checkpoint_path)
+                prefetch_executor.shutdown(wait=True, cancel_futures=True)
+                prefetch_reader.close()
+                reader.close()
                 cv2.destroyAllWindows()
                 sys.exit(0)
             # --- MODIFICATION START ---
-            # Update navigation to respect the new boundaries
-            elif key == ord('j') and not custom_input_mode:  # Go back 1 frame
-                current_frame = max(rewind_limit, current_frame - 1)
-            elif key == ord('k') and not custom_input_mode:  # Advance 1 frame
-                current_frame = min(forward_limit, current_frame + 1)
-            elif key == ord('h') and not custom_input_mode:  # Go back 10 frames
-                current_frame = max(rewind_limit, current_frame - 10)
-            elif key == ord('l') and not custom_input_mode:  # Advance 10 frames
-                current_frame = min(forward_limit, current_frame + 10)
+            # Update navigation (j/k: -/+1, h/l: -/+10) to respect the new boundaries
+            elif key in NAV_STEPS and not custom_input_mode:
+                current_frame = max(rewind_limit, min(forward_limit, current_frame + NAV_STEPS[key]))
             # --- MODIFICATION END ---
-            elif key == ord('u') and not custom_input_mode and not flag_menu_active:  # Go to previous attempt
+            elif key == KEY_U and not custom_input_mode and not flag_menu_active:  # Go to previous attempt
                 if current_attempt_index > 0:
                     current_attempt_index -= 1
-                    prev_row = df.iloc[current_attempt_index]
-                    current_frame = int(prev_row['attempt_start_frame'])
                     print(f"Jumped to attempt {current_attempt_index + 1}")
                     break
                 else:
                     print("Already at first attempt")
-            elif key == ord('i') and not custom_input_mode and not flag_menu_active:  # Go to next attempt
-                if current_attempt_index < len(df) - 1:
+            elif key == KEY_I and not custom_input_mode and not flag_menu_active:  # Go to next attempt
+                if current_attempt_index < len(attempts) - 1:
                     current_attempt_index += 1
-                    next_row = df.iloc[current_attempt_index]
-                    current_frame = int(next_row['attempt_start_frame'])
                     print(f"Jumped to attempt {current_attempt_index + 1}")
                     break
                 else:
                     print("Already at last attempt")
-            elif key == ord('0') and not flag_menu_active:
-                falling_block_value = 0
+            elif key in CLASSIFY_CHOICES and not flag_menu_active:
+                falling_block_value, description = CLASSIFY_CHOICES[key]
                 classified = True
-                print(f"Attempt {attempt_num} classified as ground_truth_block_drop = 0 (block did not fall)")
-            elif key == ord('1') and not flag_menu_active:
-                falling_block_value = 1
-                classified = True
-                print(f"Attempt {attempt_num} classified as ground_truth_block_drop = 1 (block fell)")
-            elif key == ord('2'):
+                print(f"Attempt {attempt_num} classified as ground_truth_block_drop = {falling_block_value} ({description})")
+            elif key == KEY_2:
                 if flag_menu_active:
                     flag_menu_active = False
                     custom_input_mode = False
-                    custom_text = ""
+                    custom_chars = []
                     print("Returned to main menu")
                 else:
                     flag_menu_active = True
                     custom_input_mode = False
-                    custom_text = ""
+                    custom_chars = []
                     print("Flag menu opened")
             elif flag_menu_active and not custom_input_mode:
-                if key == ord('w'):
-                    falling_block_value = 2
+                if key in FLAG_CHOICES:
+                    falling_block_value, reason_for_flag = FLAG_CHOICES[key]
                     is_flagged = 1
-                    reason_for_flag = "Block transferred, but failure because the fingers did not cross"
                     classified = True
                     print(f"Attempt {attempt_num} flagged: {reason_for_flag}")
-                elif key == ord('e'):
-                    falling_block_value = 3
-                    is_flagged = 1
-                    reason_for_flag = "Block transferred, but fingers might not have crossed"
-                    classified = True
-                    print(f"Attempt {attempt_num} flagged: {reason_for_flag}")
-                elif key == ord('r'):
-                    falling_block_value = 4
-                    is_flagged = 1
-                    reason_for_flag = "Needs manual review"
-                    classified = True
-                    print(f"Attempt {attempt_num} flagged: {reason_for_flag}")
-                elif key == ord('t'):
+                elif key == KEY_T:
                     custom_input_mode = True
-                    custom_text = ""
+                    custom_chars = []
                     print("Custom input mode activated")
             elif custom_input_mode:
-                if key == 27:  # Escape key
+                if key == KEY_ESCAPE:
                     custom_input_mode = False
-                    custom_text = ""
+                    custom_chars = []
                     print("Returned to flag menu")
-                elif key == 13:  # Enter key
-                    if custom_text.strip():
+                elif key == KEY_ENTER:
+                    custom_text = ''.join(custom_chars).strip()
+                    if custom_text:
                         falling_block_value = 5
                         is_flagged = 1
-                        reason_for_flag = custom_text.strip()
+                        reason_for_flag = custom_text
                         classified = True
                         print(f"Attempt {attempt_num} flagged with custom reason: {reason_for_flag}")
                     else:
                         print("No text entered, staying in custom input mode")
                 elif key == 8 or key == 127:
-                    if custom_text:
-                        custom_text = custom_text[:-1]
-                elif key >= 32 and key <= 126:
-                    custom_text += chr(key)
+                    if custom_chars:
+                        custom_chars.pop()
+                elif key in PRINTABLE_KEYS:
+                    custom_chars.append(chr(key))
         
         if classified:
-            output_row = row.copy()
-            output_row['ground_truth_block_drop'] = falling_block_value
-            output_row['is_flagged'] = is_flagged
-            output_row['reason_for_flag'] = reason_for_flag
+            ground_truth_values[index] = falling_block_value
+            flag_values[index] = is_flagged
+            flag_reasons[index] = reason_for_flag
             
-            with open(output_csv, 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(output_row.values)
+            checkpoint_file.write(json.dumps({
+                'attempt_start_frame': start_frame,
+                'attempt_end_frame': end_frame,
+                'ground_truth_block_drop': falling_block_value,
+                'is_flagged': is_flagged,
+                'reason_for_flag': reason_for_flag,
+            }) + "\n")
             
             print(f"✓ Attempt {attempt_num} saved with ground_truth_block_drop = {falling_block_value}, is_flagged = {is_flagged}")
             
             current_attempt_index += 1
     
-    cap.release()
+    write_classifications(fieldnames, attempts, output_csv, ground_truth_values, flag_values, flag_reasons, extra_rows)
+    # Everything in the log is now in the CSV
+    checkpoint_file.close()
+    os.remove(checkpoint_path)
+    prefetch_executor.shutdown(wait=True, cancel_futures=True)
+    prefetch_reader.close()
+    reader.close()
     cv2.destroyAllWindows()
     
     print(f"Classification complete!")
-    print(f"Classified {len(df)} attempts")
+    print(f"Classified {len(attempts)} attempts")
     print(f"Results saved to: {output_csv}")
 
 if __name__ == "__main__":
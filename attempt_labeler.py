@@ -2,9 +2,14 @@
 
 import cv2
 import csv
+import json
 import sys
 import os
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from frame_reader import DISPLAY_MAX_WIDTH, FrameReader, FramePrefetcher
 # Assuming keypoint_detector.py exists in the same directory or is importable
 from keypoint_detector import BoxDetector 
 
@@ -15,6 +20,56 @@ Crossing: When any one knuckle or fingertip crosses the divider line.
 End: When all the topmost knuckles goe below the blue line. 
 """
 
+# Frames skipped by 'f' (fast-forward)
+FAST_FORWARD_FRAMES = 30
+# Forward gaps up to this many frames are skipped with grab() instead of a keyframe seek
+MAX_GRAB_SKIP = 10
+
+# Box keypoints are re-detected when the scene changes noticeably (mean absolute difference of
+# a 64x64 grayscale thumbnail) or after this many frames, whichever comes first
+BOX_CHANGE_THRESHOLD = 20
+BOX_REDETECT_FRAMES = 5000
+
+# Unsaved attempts are written to the CSV at most this often while labeling
+AUTOSAVE_INTERVAL_S = 60
+
+# Labels drawn next to the threshold lines and their ((width, height), baseline) sizes,
+# which are fixed for the font used in draw_thresholds
+ABOVE_TEXT = "ABOVE THRESHOLD"
+BELOW_TEXT = "BELOW THRESHOLD"
+ABOVE_TEXT_SIZE = cv2.getTextSize(ABOVE_TEXT, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
+BELOW_TEXT_SIZE = cv2.getTextSize(BELOW_TEXT, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
+
+# How long "recorded"/"erased" messages stay on screen
+RECORDED_MESSAGE_S = 2.0
+# Poll interval of the idle key wait, which lets finished detections and expired messages
+# redraw the frame without a keypress
+IDLE_WAIT_MS = 15
+
+# Keys the main loop acts on; anything else is ignored without redrawing the frame
+HANDLED_KEYS = frozenset(map(ord, 'qklfhj123 '))
+
+CONTROL_TEXT = f"k: +1 | l: +10 | f: +{FAST_FORWARD_FRAMES} | j: -1 | h: -10 | space: play | 1: start | 2: cross | 3: end | q: quit"
+# Y-position of the first attempt status line; later lines are STATUS_LINE_SPACING below
+STATUS_Y_POS = 110
+STATUS_LINE_SPACING = 30
+
+CSV_HEADERS = ['attempt_number', 'attempt_start_time', 'attempt_end_time',
+               'attempt_start_frame', 'attempt_end_frame',
+               'cross_time', 'cross_frame']
+
+# Keypoints the thresholds are derived from, in the row order used by thresholds_from_keypoints
+THRESHOLD_KEYPOINTS = ('Front divider top', 'Back divider top', 'Back top left', 'Back top right')
+
+
+def thresholds_from_keypoints(box_detection):
+    """
+    Returns (above_threshold_y, below_threshold_y, divider_line_x) from a box detection.
+    """
+    points = np.array([box_detection[name] for name in THRESHOLD_KEYPOINTS], dtype=np.float32)
+    return points[0, 1], points[2:, 1].min(), points[:2, 0].mean()
+
+
 def get_box(frame, box_detector: BoxDetector, width, height):
     """
     Detects keypoints for a box on the frame and returns y-coordinates for two thresholds.
@@ -25,11 +80,7 @@ def get_box(frame, box_detector: BoxDetector, width, height):
     # Attempt to detect box keypoints
     ok, box_detection = box_detector.detect(frame)
     if ok:
-        above_threshold_y = box_detection['Front divider top'][1]
-        below_threshold_y = min(box_detection['Back top left'][1], box_detection['Back top right'][1])
-        divider_line_x = (box_detection['Front divider top'][0] + box_detection['Back divider top'][0]) / 2
-
-        return above_threshold_y, below_threshold_y, divider_line_x
+        return thresholds_from_keypoints(box_detection)
     elif box_detection is not None and not ok:
         # If detection was partial, try to guess missing keypoints
         box_detection = box_detector.guess_missing_keypoints(
@@ -40,11 +91,7 @@ def get_box(frame, box_detector: BoxDetector, width, height):
 
         if box_detection is not None:
             # From guessed points
-            above_threshold_y = box_detection['Front divider top'][1]
-            below_threshold_y = min(box_detection['Back top left'][1], box_detection['Back top right'][1])
-            divider_line_x = (box_detection['Front divider top'][0] + box_detection['Back divider top'][0]) / 2
-            
-            return above_threshold_y, below_threshold_y,divider_line_x
+            return thresholds_from_keypoints(box_detection)
         else:
             # If guessing also fails
             return 0, 0, 0 # Return default values
@@ -53,6 +100,14 @@ def get_box(frame, box_detector: BoxDetector, width, height):
         return 0, 0, 0 # Return default values
 
 
+def scene_thumbnail(frame):
+    """
+    Returns a tiny grayscale version of the frame for cheap scene-change checks.
+    """
+    small = cv2.resize(frame, (64, 64), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+
 def draw_thresholds(frame, above_threshold_y, below_threshold_y, divider_threshold_x):
     """
     Draws a red horizontal line with "ABOVE THRESHOLD" text and a blue horizontal line
@@ -89,8 +144,8 @@ def draw_thresholds(frame, above_threshold_y, below_threshold_y, divider_thresho
     # --- Draw the red line for above_threshold ---
     cv2.line(frame, (0, above_threshold_y), (width - 1, above_threshold_y), RED, line_thickness)
 
-    above_text = "ABOVE THRESHOLD"
-    (above_text_width, above_text_height), above_baseline = cv2.getTextSize(above_text, font, font_scale, font_thickness)
+    above_text = ABOVE_TEXT
+    (above_text_width, above_text_height), above_baseline = ABOVE_TEXT_SIZE
     
     # Determine Y-position for ABOVE THRESHOLD text (baseline)
     above_text_y_baseline_option1 = above_threshold_y - text_vertical_buffer
@@ -108,8 +163,8 @@ def draw_thresholds(frame, above_threshold_y, below_threshold_y, divider_thresho
     # --- Draw the blue line for below_threshold ---
     cv2.line(frame, (0, below_threshold_y), (width - 1, below_threshold_y), BLUE, line_thickness)
 
-    below_text = "BELOW THRESHOLD"
-    (below_text_width, below_text_height), below_baseline = cv2.getTextSize(below_text, font, font_scale, font_thickness)
+    below_text = BELOW_TEXT
+    (below_text_width, below_text_height), below_baseline = BELOW_TEXT_SIZE
 
     # Determine Y-position for BELOW THRESHOLD text (baseline)
     below_text_y_baseline_option1 = below_threshold_y + text_vertical_buffer + below_text_height
@@ -130,12 +185,170 @@ def draw_thresholds(frame, above_threshold_y, below_threshold_y, divider_thresho
     return frame
 
 
+def draw_status_lines(frame, status_lines):
+    """
+    Draws the current attempt's status lines one below the other, starting at STATUS_Y_POS.
+    """
+    y_offset = STATUS_Y_POS
+    for line in status_lines:
+        cv2.putText(frame, line, (10, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+        y_offset += STATUS_LINE_SPACING # Move down for next line
+    return frame
+
+
+def render_overlay(height, width, draw):
+    """
+    Renders drawing calls once so they can be stamped onto frames without re-rasterizing.
+    The calls are drawn on a black and on a white canvas: pixels that come out the same on
+    both are fully covered, and pixels that differ are anti-aliased edges whose coverage is
+    given by the difference, so they can be blended instead of pasted with a dark fringe.
+
+    Args:
+        height (int): Frame height.
+        width (int): Frame width.
+        draw (callable): Called with a blank (height, width, 3) canvas to draw on.
+
+    Returns:
+        tuple: (index, pixels, edge_index, edge_pixels, edge_keep) - the flat indices and BGR
+        values of the fully covered pixels, and the flat indices, coverage-weighted BGR values
+        and remaining background weight of the edge pixels, for use with blend_overlay().
+    """
+    on_black = np.zeros((height, width, 3), dtype=np.uint8)
+    draw(on_black)
+    on_white = np.full((height, width, 3), 255, dtype=np.uint8)
+    draw(on_white)
+    # 255 * (1 - coverage): 0 where fully covered, 255 where nothing was drawn
+    uncovered = (on_white.astype(np.int16) - on_black).reshape(-1, 3).max(axis=1)
+    index = np.flatnonzero(uncovered == 0)
+    edge_index = np.flatnonzero((uncovered > 0) & (uncovered < 255))
+    edge_keep = (uncovered[edge_index] / 255.0).astype(np.float32)[:, None]
+    on_black = on_black.reshape(-1, 3)
+    return index, on_black[index], edge_index, on_black[edge_index].astype(np.float32), edge_keep
+
+
+def blend_overlay(frame, overlay):
+    """
+    Stamps a rendered overlay onto a frame in place. The frame must be contiguous.
+    """
+    index, pixels, edge_index, edge_pixels, edge_keep = overlay
+    flat = frame.reshape(-1, 3)
+    flat[index] = pixels
+    if len(edge_index):
+        flat[edge_index] = (edge_pixels + flat[edge_index] * edge_keep + 0.5).astype(np.uint8)
+
+
+def capture_frame_number(cap, fps):
+    """
+    Number of the frame last grabbed from the capture, from its timestamp: round(t * fps),
+    the numbering FrameReader uses. CAP_PROP_POS_FRAMES counts grabs instead, which drifts
+    from the timestamps on variable frame rate files.
+    """
+    return int(np.floor(cap.get(cv2.CAP_PROP_POS_MSEC) * fps / 1000 + 0.5))
+
+
+def read_frame(cap, frame_index, fps, size=None):
+    """
+    Decodes a frame, seeking only when it isn't reachable by reading forward. The next frame
+    is a plain read, a short forward jump grabs (without converting) the frames in between,
+    and anything else seeks. Frames are numbered by timestamp (see capture_frame_number), so
+    an index no frame rounds to is served by the next frame, as FrameReader does. Only ever
+    called on the prefetch thread, so the capture is never touched by two threads at once.
+
+    Args:
+        cap (cv2.VideoCapture): The open video capture.
+        frame_index (int): Index of the frame to decode.
+        fps (float): Frame rate the indices are based on.
+        size (tuple): Optional (width, height) to scale the frame down to.
+
+    Returns:
+        tuple: (ret, frame) as returned by cap.read().
+    """
+    # Number of the frame last grabbed, or -1 before the first grab
+    position = capture_frame_number(cap, fps) if cap.get(cv2.CAP_PROP_POS_FRAMES) > 0 else -1
+    if not position < frame_index <= position + 1 + MAX_GRAB_SKIP:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+    # Grab up to the first frame numbered frame_index or later, converting only that one
+    while True:
+        if not cap.grab():
+            return False, None
+        if capture_frame_number(cap, fps) >= frame_index:
+            break
+    ret, frame = cap.retrieve()
+    if ret and size is not None:
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    return ret, frame
+
+
+def replay_checkpoint(checkpoint_path, recorded_attempts):
+    """
+    Re-applies the checkpoint log left behind by a session that ended without writing
+    its CSV (e.g. a crash), so the attempts recorded in it are not lost.
+    Each line either records an attempt or erases every attempt ending at or after a frame.
+    A recorded attempt that matches one already in the list (on number, start and end frame)
+    is skipped, since a crash between writing the CSV and clearing the log leaves lines
+    the CSV already contains.
+
+    Returns:
+        int: Number of log entries that were applied.
+    """
+    def attempt_key(attempt):
+        return attempt['number'], attempt['start_frame'], attempt['end_frame']
+
+    known = {attempt_key(attempt) for attempt in recorded_attempts}
+    applied = 0
+    with open(checkpoint_path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Line cut short by a crash
+            if 'record' in entry:
+                attempt = entry['record']
+                if attempt_key(attempt) in known:
+                    continue  # Already in the CSV
+                recorded_attempts.append(attempt)
+                known.add(attempt_key(attempt))
+            elif 'erase_from' in entry:
+                while recorded_attempts and recorded_attempts[-1]['end_frame'] >= entry['erase_from']:
+                    known.discard(attempt_key(recorded_attempts.pop()))
+            applied += 1
+    return applied
+
+
+def save_attempts(csv_file, recorded_attempts):
+    """
+    Writes all recorded attempts to the output CSV in one pass. The rows are written to a
+    temporary file first and then moved over the CSV, so an interrupted write never leaves
+    a truncated file behind.
+
+    Args:
+        csv_file (str): Path of the output CSV.
+        recorded_attempts (list): The attempt dicts collected during labeling.
+    """
+    os.makedirs(os.path.dirname(csv_file), exist_ok=True) # Ensure output directory exists
+    tmp_file = csv_file + '.tmp'
+    with open(tmp_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADERS)
+        writer.writerows([attempt['number'], attempt['start_time'], attempt['end_time'],
+                          attempt['start_frame'], attempt['end_frame'],
+                          attempt['cross_time'] if attempt['cross_time'] is not None else '', # Write empty string if None
+                          attempt['cross_frame'] if attempt['cross_frame'] is not None else ''] # Write empty string if None
+                         for attempt in recorded_attempts)
+    os.replace(tmp_file, csv_file)
+
+
 def main():
     if len(sys.argv) != 2:
         print("Usage: python3 attempt_labeler.py <video_file>")
         sys.exit(1)
     
     video_path = sys.argv[1]
+    
+    # Per-frame OpenCV work here is a handful of small resize/draw calls, where spinning up
+    # a thread pool (or an OpenCL context) costs more than it saves
+    cv2.setNumThreads(1)
+    cv2.ocl.setUseOpenCL(False)
 
     # Check if video file exists
     if not os.path.exists(video_path):
@@ -155,22 +368,59 @@ def main():
 
 
     # Open video file
-    cap = cv2.VideoCapture(video_path)
-    
-    if not cap.isOpened():
-        print(f"Error: Could not open video file '{video_path}'")
-        sys.exit(1)
+    # PyAV seeks straight to the right keyframe using a per-video packet index (shared with
+    # attempt_classifier.py); OpenCV is only used if PyAV is missing or can't open the file
+    frame_reader = None
+    try:
+        frame_reader = FrameReader(video_path, cache_size=0) # The prefetcher keeps its own cache
+    except Exception as e:
+        print(f"PyAV could not open the video ({e}), falling back to OpenCV")
     
-    # Get video properties
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if frame_reader is not None:
+        fps = frame_reader.fps
+        total_frames = frame_reader.total_frames
+        frame_width = frame_reader.width
+        frame_height = frame_reader.height
+        read_video_frame = frame_reader.read
+        close_video = frame_reader.close
+    else:
+        # Request FFmpeg explicitly so OpenCV skips probing its other backends, and let it
+        # use a hardware decoder when one is available (OpenCV 4.5.2+; older builds have
+        # neither the constant nor the VideoCapture overload that takes a params list)
+        cap = None
+        if hasattr(cv2, 'VIDEO_ACCELERATION_ANY'):
+            cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG,
+                                   [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap is None or not cap.isOpened():
+            # Software decoding
+            cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+        
+        if not cap.isOpened():
+            print(f"Error: Could not open video file '{video_path}'")
+            sys.exit(1)
+        
+        # Keep the capture's internal queue to a single frame so seek+read returns promptly
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        
+        # Get video properties
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # Scale large frames down for display, as FrameReader does during decode; this also
+        # keeps the prefetcher's cached frames small
+        display_size = None
+        if frame_width > DISPLAY_MAX_WIDTH:
+            frame_height = int(frame_height * DISPLAY_MAX_WIDTH / frame_width)
+            frame_width = DISPLAY_MAX_WIDTH
+            display_size = (frame_width, frame_height)
+        read_video_frame = lambda index: read_frame(cap, index, fps, display_size)
+        close_video = cap.release
     
     # Handle empty video (0 frames)
     if total_frames == 0:
         print("Error: Video contains 0 frames. Exiting.")
-        cap.release()
+        close_video()
         sys.exit(1)
 
     print(f"Video loaded: {video_path}")
@@ -178,11 +428,13 @@ def main():
     print("\nControls:")
     print("- Press 'k' to advance frame (+1)")
     print("- Press 'l' to advance frames (+10)")
+    print(f"- Press 'f' to fast-forward (+{FAST_FORWARD_FRAMES})")
     print("- Press 'j' to rewind frame (-1, with undo logic)")
     print("- Press 'h' to rewind frames (-10, with undo logic)") # Updated control description
+    print("- Press space to play/pause continuous playback")
     print("- Press '1' to mark attempt start")
     print("- Press '2' to mark cross frame (e.g., when fingers cross the plane)")
-    print("- Press '3' to mark attempt end (and save current attempt to CSV)")
+    print("- Press '3' to mark attempt end (attempts are written to CSV on quit)")
     print("- Press 'q' to quit (progress will be saved)")
     print("\nStarting playback...")
     
@@ -193,33 +445,44 @@ def main():
     cross_frame = None
     cross_time = None
     current_frame = 0
+    paused = True # Space toggles continuous playback; keys still work while playing
+    playback_wait_ms = max(1, int(1000 / fps)) if fps > 0 else IDLE_WAIT_MS
     
     csv_file = f"./outputs/attempt_labels/{video_name}_attempt_ground_truths.csv"
+    checkpoint_path = f"./outputs/attempt_labels/{video_name}_attempt_ground_truths_checkpoint.jsonl"
     recorded_message = None
-    recorded_message_timer = 0
-    recorded_attempts = []  # Store completed attempts to track for deletion and rewriting
+    recorded_message_until = 0.0 # time.monotonic() deadline for hiding recorded_message
+    recorded_attempts = []  # Completed attempts; written to the CSV once when labeling ends
+    
+    # All capture access goes through a background thread that decodes the frames around
+    # current_frame while the main thread sits in waitKey, so navigation keys rarely wait
+    prefetcher = FramePrefetcher(read_video_frame, total_frames)
+    
+    # Keypoint detection runs on its own worker thread so inference never freezes the UI;
+    # the last known thresholds stay on screen until a new result arrives
+    detector_executor = ThreadPoolExecutor(max_workers=1)
+    box_future = None
+    box_detected = False
+    box_frame = None  # frame the current thresholds were detected on
+    box_thumbnail = None
     
     # Initialize default threshold lines (will be updated by get_box)
     above_line_y = 0
     below_line_y = frame_height # Set to bottom of frame initially
     divider_line_x = 0
+    # The threshold lines only change when get_box runs, so they are rendered once per update
+    threshold_overlay = render_overlay(frame_height, frame_width, lambda canvas: draw_thresholds(canvas, above_line_y, below_line_y, divider_line_x))
+    # The control text never changes and the status lines only change on '1'/'2'/'3' and rewinds
+    control_overlay = render_overlay(frame_height, frame_width, lambda canvas: cv2.putText(canvas, CONTROL_TEXT, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2))
+    status_overlay_lines = None
+    status_overlay = None
     
-    # Create CSV file with headers if it doesn't exist
-    if not os.path.exists(csv_file):
-        os.makedirs(os.path.dirname(csv_file), exist_ok=True) # Ensure output directory exists
-        with open(csv_file, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['attempt_number', 'attempt_start_time', 'attempt_end_time', 
-                           'attempt_start_frame', 'attempt_end_frame',
-                           'cross_time', 'cross_frame'])
-    else:
-        # If CSV exists, load existing data to continue labeling
+    # If CSV exists, load existing data to continue labeling
+    if os.path.exists(csv_file):
         with open(csv_file, 'r', newline='') as f:
             reader = csv.DictReader(f)
             # Check if headers match, if not, print warning (or handle migration)
-            expected_headers = ['attempt_number', 'attempt_start_time', 'attempt_end_time', 
-                                'attempt_start_frame', 'attempt_end_frame',
-                                'cross_time', 'cross_frame']
+            expected_headers = CSV_HEADERS
             if reader.fieldnames != expected_headers:
                 print(f"Warning: Existing CSV headers do not match expected headers. "
                       f"Expected: {expected_headers}, Found: {reader.fieldnames}")
@@ -240,246 +503,299 @@ def main():
                     })
                 except (ValueError, KeyError) as e:
                     print(f"Error reading existing CSV row: {row}. Skipping. Error: {e}")
-        
-        if recorded_attempts:
-            attempt_number = max(a['number'] for a in recorded_attempts) + 1
-            print(f"Loaded {len(recorded_attempts)} existing attempts. Continuing from attempt {attempt_number}.")
-            # Set current_frame to end of last recorded attempt to continue from there
-            current_frame = recorded_attempts[-1]['end_frame']
-            # Ensure current_frame doesn't exceed total_frames-1
-            current_frame = min(current_frame, total_frames - 1) 
-            cap.set(cv2.CAP_PROP_POS_FRAMES, current_frame)
-
+    
+    # Keep the list ordered by end frame so rewinds only have to look at its tail
+    recorded_attempts.sort(key=lambda x: x['end_frame'])
+    
+    attempts_dirty = False  # recorded_attempts differs from what is in the CSV
+    
+    # A checkpoint log only survives a session whose CSV was never written (e.g. a crash)
+    if os.path.exists(checkpoint_path):
+        applied = replay_checkpoint(checkpoint_path, recorded_attempts)
+        print(f"Recovered {applied} unsaved changes from {checkpoint_path}")
+        attempts_dirty = applied > 0
+    
+    if recorded_attempts:
+        attempt_number = max(a['number'] for a in recorded_attempts) + 1
+        print(f"Loaded {len(recorded_attempts)} existing attempts. Continuing from attempt {attempt_number}.")
+        # Set current_frame to end of last recorded attempt to continue from there
+        current_frame = recorded_attempts[-1]['end_frame']
+        # Ensure current_frame doesn't exceed total_frames-1
+        current_frame = min(current_frame, total_frames - 1) 
+    
+    # Every recorded or erased attempt is logged through one long-lived, line-buffered
+    # handle, so a crash before the CSV is written loses nothing
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    checkpoint_file = open(checkpoint_path, 'a', buffering=1)
+    last_save_time = time.monotonic()
 
-    while True:
-        # Ensure correct frame is read after 'j', 'h' or initialization
-        # Also ensures we don't try to seek beyond the last frame for reading
-        cap.set(cv2.CAP_PROP_POS_FRAMES, current_frame)
-        ret, frame = cap.read()
+    # Write the CSV however the loop exits (q, unrecoverable read error or Ctrl-C)
+    try:
+        while True:
+            # Periodically write unsaved attempts to the CSV; the log then starts over
+            if attempts_dirty and time.monotonic() - last_save_time > AUTOSAVE_INTERVAL_S:
+                save_attempts(csv_file, recorded_attempts)
+                checkpoint_file.seek(0)
+                checkpoint_file.truncate()
+                attempts_dirty = False
+                last_save_time = time.monotonic()
+            
+            # Ensure correct frame is read after 'j', 'h' or initialization
+            # (usually already decoded by the prefetcher)
+            ret, frame = prefetcher.get(current_frame)
         
-        if not ret:
-            # We have reached or overshot the end of the video.
-            # Set current_frame to the last valid frame and re-read it.
-            print("End of video reached. Staying on the last frame. Press 'q' to quit or 'j'/'h' to rewind.")
-            current_frame = total_frames - 1 # Go back to the last valid frame
-            cap.set(cv2.CAP_PROP_POS_FRAMES, current_frame)
-            ret, frame = cap.read() # Re-read the last frame to ensure 'frame' is valid
+            if not ret:
+                # We have reached or overshot the end of the video.
+                # Set current_frame to the last valid frame and re-read it.
+                print("End of video reached. Staying on the last frame. Press 'q' to quit or 'j'/'h' to rewind.")
+                current_frame = total_frames - 1 # Go back to the last valid frame
+                # Re-read the last frame to ensure 'frame' is valid
+                ret, frame = prefetcher.get(current_frame)
             
-            if not ret: # If even re-reading the last frame fails, something is very wrong.
-                print("Critical Error: Could not retrieve last frame. Exiting.")
-                break # This is an unrecoverable error.
+                if not ret: # If even re-reading the last frame fails, something is very wrong.
+                    print("Critical Error: Could not retrieve last frame. Exiting.")
+                    break # This is an unrecoverable error.
 
-            # Do NOT break here. Continue to display and wait for input.
-            # The user can still press 'q' or rewind.
+                # Do NOT break here. Continue to display and wait for input.
+                # The user can still press 'q' or rewind.
         
-        # Update box keypoints at specified interval (e.g., every 300 frames)
-        if current_frame % 5000 == 0:
-            above_line_y_float, below_line_y_float, divider_line_x = get_box(frame, box_detector, frame_width, frame_height)
-            above_line_y = int(above_line_y_float)
-            below_line_y = int(below_line_y_float)
-            divider_line_x = int(divider_line_x)
+            # Update box keypoints when the scene has changed or they are getting old
+            # (the cached frame is never drawn on, so the detector can read it directly)
+            if box_future is None:
+                thumbnail = scene_thumbnail(frame)
+                if (box_thumbnail is None
+                        or abs(current_frame - box_frame) >= BOX_REDETECT_FRAMES
+                        or np.abs(thumbnail - box_thumbnail).mean() > BOX_CHANGE_THRESHOLD):
+                    box_future = detector_executor.submit(get_box, frame, box_detector, frame_width, frame_height)
+                    box_frame = current_frame
+                    box_thumbnail = thumbnail
+                    if not box_detected:
+                        box_future.result() # Nothing to show yet, so wait for the first detection
+            if box_future is not None and box_future.done():
+                above_line_y_float, below_line_y_float, divider_line_x = box_future.result()
+                box_future = None
+                box_detected = True
+                above_line_y = int(above_line_y_float)
+                below_line_y = int(below_line_y_float)
+                divider_line_x = int(divider_line_x)
+                threshold_overlay = render_overlay(frame_height, frame_width, lambda canvas: draw_thresholds(canvas, above_line_y, below_line_y, divider_line_x))
 
         
 
-        # Draw the threshold lines on the frame
-        frame = draw_thresholds(frame, above_line_y, below_line_y, divider_line_x)
+            # Draw the threshold lines on a copy so the cached frame stays clean
+            frame = frame.copy()
+            blend_overlay(frame, threshold_overlay)
       
-        # Calculate current time in seconds
-        current_time = current_frame / fps
-        
-        # Display control messages
-        control_text = "k: +1 | l: +10 | j: -1 | h: -10 | 1: start | 2: cross | 3: end | q: quit" 
-        cv2.putText(frame, control_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+            # Calculate current time in seconds
+            current_time = current_frame / fps
         
-        # Display frame info on the frame
-        info_text = f"Frame: {current_frame} | Time: {current_time:.2f}s"
-        cv2.putText(frame, info_text, (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            # Display control messages
+            blend_overlay(frame, control_overlay)
         
-        # Show current attempt status
-        status_lines = []
-        if attempt_start_frame is not None:
-            status_lines.append(f"Attempt {attempt_number} START: {attempt_start_frame} ({attempt_start_time:.2f}s)")
-        if cross_frame is not None:
-            status_lines.append(f"CROSS: {cross_frame} ({cross_time:.2f}s)")
+            # Display frame info on the frame
+            info_text = f"Frame: {current_frame} | Time: {current_time:.2f}s"
+            cv2.putText(frame, info_text, (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
         
-        y_offset = 110
-        for line in status_lines:
-            cv2.putText(frame, line, (10, y_offset), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-            y_offset += 30 # Move down for next line
-
-        # Show recorded message if active
-        if recorded_message and recorded_message_timer > 0:
-            cv2.putText(frame, recorded_message, (10, y_offset + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 50 , 255), 2)
-            recorded_message_timer -= 1
+            # Show current attempt status
+            status_lines = []
+            if attempt_start_frame is not None:
+                status_lines.append(f"Attempt {attempt_number} START: {attempt_start_frame} ({attempt_start_time:.2f}s)")
+            if cross_frame is not None:
+                status_lines.append(f"CROSS: {cross_frame} ({cross_time:.2f}s)")
+            if status_lines != status_overlay_lines:
+                status_overlay = render_overlay(frame_height, frame_width, lambda canvas: draw_status_lines(canvas, status_lines))
+                status_overlay_lines = status_lines
+            blend_overlay(frame, status_overlay)
+            y_offset = STATUS_Y_POS + STATUS_LINE_SPACING * len(status_lines)
+
+            # Show recorded message if active
+            if recorded_message and recorded_message_until > time.monotonic():
+                cv2.putText(frame, recorded_message, (10, y_offset + 20), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 50 , 255), 2)
         
-        # Display the frame
-        cv2.imshow('Attempt Labeler', frame)
+            # Display the frame
+            cv2.imshow('Attempt Labeler', frame)
         
-        # Wait for key press
-        key = cv2.waitKey(0) & 0xFF
+            # Wait for key press
+            key = cv2.waitKey(IDLE_WAIT_MS if paused else playback_wait_ms) & 0xFF
+            while key not in HANDLED_KEYS:
+                if not paused:
+                    break # Playing: move on to the next frame
+                # A closed window makes waitKey return -1 forever, so treat closing it as 'q'
+                if cv2.getWindowProperty('Attempt Labeler', cv2.WND_PROP_VISIBLE) < 1:
+                    key = ord('q')
+                    break
+                # Nothing (useful) pressed: only redraw once a detection finishes or the message expires
+                if box_future is not None and box_future.done():
+                    break
+                if recorded_message and recorded_message_until <= time.monotonic():
+                    recorded_message = None
+                    break
+                key = cv2.waitKey(IDLE_WAIT_MS) & 0xFF
         
-        if key == ord('q'):
-            print("Quitting...")
-            break
-        elif key == ord('k'):
-            # Advance one frame.
-            new_frame = current_frame + 1
-            if new_frame >= total_frames: # Ensure we don't go past the last frame
-                current_frame = total_frames - 1
-                print("Already at the end of the video. Cannot advance further.")
-            else:
-                current_frame = new_frame
+            if key == ord('q'):
+                print("Quitting...")
+                break
+            elif key == ord(' '):
+                paused = not paused
+                print("Playback paused" if paused else "Playing...")
+            elif key == ord('k'):
+                # Advance one frame.
+                new_frame = current_frame + 1
+                if new_frame >= total_frames: # Ensure we don't go past the last frame
+                    current_frame = total_frames - 1
+                    print("Already at the end of the video. Cannot advance further.")
+                else:
+                    current_frame = new_frame
+                    print(f"Advanced to frame {current_frame}")
+            elif key == ord('l'):
+                # Advance 10 frames
+                new_frame = current_frame + 10
+                # Ensure new_frame does not exceed total_frames - 1
+                current_frame = min(total_frames - 1, new_frame) 
                 print(f"Advanced to frame {current_frame}")
-        elif key == ord('l'):
-            # Advance 10 frames
-            new_frame = current_frame + 10
-            # Ensure new_frame does not exceed total_frames - 1
-            current_frame = min(total_frames - 1, new_frame) 
-            print(f"Advanced to frame {current_frame}")
-        elif key == ord('1'):
-            # Mark attempt start
-            attempt_start_frame = current_frame
-            attempt_start_time = current_time
-            cross_frame = None # Reset cross_frame for new attempt
-            cross_time = None  # Reset cross_time for new attempt
-            print(f"Attempt {attempt_number} start marked - Frame: {current_frame}, Time: {current_time:.2f}s")
-        elif key == ord('2'):
-            # Mark cross frame
-            if attempt_start_frame is not None:
-                cross_frame = current_frame
-                cross_time = current_time
-                print(f"Attempt {attempt_number} cross frame marked - Frame: {current_frame}, Time: {current_time:.2f}s")
-            else:
-                print("Warning: Mark attempt start ('1') first before marking cross frame.")
-        elif key == ord('3'):
-            # Mark attempt end and save to CSV
-            if attempt_start_frame is not None:
-                attempt_end_frame = current_frame
-                attempt_end_time = current_time
+            elif key == ord('f'):
+                # Fast-forward (usually already decoded by the prefetcher)
+                current_frame = min(total_frames - 1, current_frame + FAST_FORWARD_FRAMES)
+                print(f"Fast-forwarded to frame {current_frame}")
+            elif key == ord('1'):
+                # Mark attempt start
+                attempt_start_frame = current_frame
+                attempt_start_time = current_time
+                cross_frame = None # Reset cross_frame for new attempt
+                cross_time = None  # Reset cross_time for new attempt
+                print(f"Attempt {attempt_number} start marked - Frame: {current_frame}, Time: {current_time:.2f}s")
+            elif key == ord('2'):
+                # Mark cross frame
+                if attempt_start_frame is not None:
+                    cross_frame = current_frame
+                    cross_time = current_time
+                    print(f"Attempt {attempt_number} cross frame marked - Frame: {current_frame}, Time: {current_time:.2f}s")
+                else:
+                    print("Warning: Mark attempt start ('1') first before marking cross frame.")
+            elif key == ord('3'):
+                # Mark attempt end
+                if attempt_start_frame is not None:
+                    attempt_end_frame = current_frame
+                    attempt_end_time = current_time
                 
-                # Write to CSV
-                with open(csv_file, 'a', newline='') as f:
-                    writer = csv.writer(f)
-                    writer.writerow([attempt_number, attempt_start_time, attempt_end_time,
-                                   attempt_start_frame, attempt_end_frame,
-                                   cross_time if cross_time is not None else '', # Write empty string if None
-                                   cross_frame if cross_frame is not None else '']) # Write empty string if None
-                
-                # Store attempt info for tracking deletions
-                recorded_attempts.append({
-                    'number': attempt_number,
-                    'start_time': attempt_start_time,
-                    'end_time': attempt_end_time,
-                    'start_frame': attempt_start_frame,
-                    'end_frame': attempt_end_frame,
-                    'cross_time': cross_time,
-                    'cross_frame': cross_frame
-                })
+                    # Store attempt info; the CSV is written from this list when labeling ends
+                    recorded_attempts.append({
+                        'number': attempt_number,
+                        'start_time': attempt_start_time,
+                        'end_time': attempt_end_time,
+                        'start_frame': attempt_start_frame,
+                        'end_frame': attempt_end_frame,
+                        'cross_time': cross_time,
+                        'cross_frame': cross_frame
+                    })
+                    checkpoint_file.write(json.dumps({'record': recorded_attempts[-1]}) + "\n")
+                    attempts_dirty = True
                 
-                print(f"✓ Attempt {attempt_number} has been recorded!")
-                print(f"  Start - Frame: {attempt_start_frame}, Time: {attempt_start_time:.2f}s")
-                if cross_frame is not None:
-                    print(f"  Cross - Frame: {cross_frame}, Time: {cross_time:.2f}s")
-                print(f"  End   - Frame: {attempt_end_frame}, Time: {attempt_end_time:.2f}s")
+                    print(f"✓ Attempt {attempt_number} has been recorded!")
+                    print(f"  Start - Frame: {attempt_start_frame}, Time: {attempt_start_time:.2f}s")
+                    if cross_frame is not None:
+                        print(f"  Cross - Frame: {cross_frame}, Time: {cross_time:.2f}s")
+                    print(f"  End   - Frame: {attempt_end_frame}, Time: {attempt_end_time:.2f}s")
                 
-                # Set message to display on video
-                recorded_message = f"Attempt {attempt_number} recorded!"
-                recorded_message_timer = 60  # Display for 60 frames
+                    # Set message to display on video
+                    recorded_message = f"Attempt {attempt_number} recorded!"
+                    recorded_message_until = time.monotonic() + RECORDED_MESSAGE_S
                 
-                # Reset for next attempt
-                attempt_number += 1
-                attempt_start_frame = None
-                attempt_start_time = None
-                cross_frame = None
-                cross_time = None
-            else:
-                print("Warning: Press '1' first to mark attempt start before pressing '3'")
-        elif key == ord('j'):
-            # Rewind one frame (with undo logic for recorded attempts)
-            if current_frame > 0:
-                new_frame = current_frame - 1
+                    # Reset for next attempt
+                    attempt_number += 1
+                    attempt_start_frame = None
+                    attempt_start_time = None
+                    cross_frame = None
+                    cross_time = None
+                else:
+                    print("Warning: Press '1' first to mark attempt start before pressing '3'")
+            elif key == ord('j'):
+                # Rewind one frame (with undo logic for recorded attempts)
+                if current_frame > 0:
+                    new_frame = current_frame - 1
                 
-                # The shared logic for checking and removing attempts due to rewind
-                current_frame, recorded_attempts, attempt_number, \
-                attempt_start_frame, attempt_start_time, cross_frame, cross_time, \
-                recorded_message, recorded_message_timer = \
-                    handle_rewind_and_undo(new_frame, current_frame, recorded_attempts, 
-                                           attempt_number, attempt_start_frame, 
-                                           attempt_start_time, cross_frame, cross_time, 
-                                           recorded_message, recorded_message_timer, csv_file)
+                    # The shared logic for checking and removing attempts due to rewind
+                    attempts_before = len(recorded_attempts)
+                    current_frame, recorded_attempts, attempt_number, \
+                    attempt_start_frame, attempt_start_time, cross_frame, cross_time, \
+                    recorded_message, recorded_message_until = \
+                        handle_rewind_and_undo(new_frame, current_frame, recorded_attempts, 
+                                               attempt_number, attempt_start_frame, 
+                                               attempt_start_time, cross_frame, cross_time, 
+                                               recorded_message, recorded_message_until)
+                    if len(recorded_attempts) < attempts_before:
+                        checkpoint_file.write(json.dumps({'erase_from': current_frame}) + "\n")
+                        attempts_dirty = True
                 
-                print(f"Rewound to frame {current_frame}")
-            else:
-                print("Already at the beginning of the video")
-        elif key == ord('h'):
-            # Rewind 10 frames (with undo logic for recorded attempts)
-            if current_frame > 0:
-                new_frame = current_frame - 10
+                    print(f"Rewound to frame {current_frame}")
+                else:
+                    print("Already at the beginning of the video")
+            elif key == ord('h'):
+                # Rewind 10 frames (with undo logic for recorded attempts)
+                if current_frame > 0:
+                    new_frame = current_frame - 10
                 
-                # The shared logic for checking and removing attempts due to rewind
-                current_frame, recorded_attempts, attempt_number, \
-                attempt_start_frame, attempt_start_time, cross_frame, cross_time, \
-                recorded_message, recorded_message_timer = \
-                    handle_rewind_and_undo(new_frame, current_frame, recorded_attempts, 
-                                           attempt_number, attempt_start_frame, 
-                                           attempt_start_time, cross_frame, cross_time, 
-                                           recorded_message, recorded_message_timer, csv_file)
+                    # The shared logic for checking and removing attempts due to rewind
+                    attempts_before = len(recorded_attempts)
+                    current_frame, recorded_attempts, attempt_number, \
+                    attempt_start_frame, attempt_start_time, cross_frame, cross_time, \
+                    recorded_message, recorded_message_until = \
+                        handle_rewind_and_undo(new_frame, current_frame, recorded_attempts, 
+                                               attempt_number, attempt_start_frame, 
+                                               attempt_start_time, cross_frame, cross_time, 
+                                               recorded_message, recorded_message_until)
+                    if len(recorded_attempts) < attempts_before:
+                        checkpoint_file.write(json.dumps({'erase_from': current_frame}) + "\n")
+                        attempts_dirty = True
                 
-                print(f"Rewound to frame {current_frame}")
+                    print(f"Rewound to frame {current_frame}")
+                else:
+                    print("Already at the beginning of the video")
+            elif not paused:
+                # No key while playing: advance one frame, pausing at the end of the video
+                if current_frame < total_frames - 1:
+                    current_frame += 1
+                else:
+                    paused = True
+                    print("End of video reached. Playback paused.")
             else:
-                print("Already at the beginning of the video")
-        else:
-            # For any other key, do nothing.
-            pass
-    
-    # Clean up
-    cap.release()
-    cv2.destroyAllWindows()
-    print(f"\nData saved to: {csv_file}")
+                # For any other key, do nothing.
+                pass
+    finally:
+        if attempts_dirty or not os.path.exists(csv_file):
+            save_attempts(csv_file, recorded_attempts)
+        # Everything in the log is now in the CSV
+        checkpoint_file.close()
+        os.remove(checkpoint_path)
+        # Clean up
+        detector_executor.shutdown(wait=True, cancel_futures=True)
+        prefetcher.close()
+        close_video()
+        cv2.destroyAllWindows()
+        print(f"\nData saved to: {csv_file}")
 
 # Helper function to encapsulate rewind and undo logic
 def handle_rewind_and_undo(new_frame, current_frame, recorded_attempts, 
                            attempt_number, attempt_start_frame, 
                            attempt_start_time, cross_frame, cross_time, 
-                           recorded_message, recorded_message_timer, csv_file):
+                           recorded_message, recorded_message_until):
     
     # Ensure new_frame does not go below 0
     new_frame = max(0, new_frame)
 
-    attempts_to_remove = []
-    for attempt in recorded_attempts:
-        # An attempt is "erased" if its end frame is now beyond the new current frame
-        if attempt['end_frame'] >= new_frame: 
-            attempts_to_remove.append(attempt)
-    
-    # Remove attempts and update CSV if necessary
-    if attempts_to_remove:
-        # Sort in reverse order to avoid index issues if removing from original list
-        attempts_to_remove.sort(key=lambda x: x['number'], reverse=True)
-        for attempt in attempts_to_remove:
-            recorded_attempts.remove(attempt)
+    # recorded_attempts is ordered by end_frame, so only the tail can have been rewound past.
+    # The common case (rewinding without touching a recorded attempt) is a single comparison.
+    # An attempt is "erased" if its end frame is now beyond the new current frame
+    if recorded_attempts and recorded_attempts[-1]['end_frame'] >= new_frame:
+        while recorded_attempts and recorded_attempts[-1]['end_frame'] >= new_frame:
+            attempt = recorded_attempts.pop()
             recorded_message = f"Attempt {attempt['number']} erased!"
-            recorded_message_timer = 60
+            recorded_message_until = time.monotonic() + RECORDED_MESSAGE_S
             print(f"Attempt {attempt['number']} erased - rewound past its end frame {attempt['end_frame']}")
         
-        # Rewrite entire CSV file without the removed attempts
-        # This will recreate the file if it was deleted due to all attempts being removed.
-        # Make sure the directory exists before writing.
-        os.makedirs(os.path.dirname(csv_file), exist_ok=True) 
-        with open(csv_file, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['attempt_number', 'attempt_start_time', 'attempt_end_time', 
-                           'attempt_start_frame', 'attempt_end_frame',
-                           'cross_time', 'cross_frame'])
-            for attempt in recorded_attempts:
-                writer.writerow([attempt['number'], attempt['start_time'], attempt['end_time'],
-                               attempt['start_frame'], attempt['end_frame'],
-                               attempt['cross_time'] if attempt['cross_time'] is not None else '',
-                               attempt['cross_frame'] if attempt['cross_frame'] is not None else ''])
-        
-        # Update attempt_number to be one more than the highest remaining attempt
+        # Update attempt_number to be one more than the last remaining attempt
         if recorded_attempts:
-            attempt_number = max(a['number'] for a in recorded_attempts) + 1
+            attempt_number = recorded_attempts[-1]['number'] + 1
         else:
             attempt_number = 1
         
@@ -496,7 +812,7 @@ def handle_rewind_and_undo(new_frame, current_frame, recorded_attempts,
         
     return new_frame, recorded_attempts, attempt_number, \
            attempt_start_frame, attempt_start_time, cross_frame, cross_time, \
-           recorded_message, recorded_message_timer
+           recorded_message, recorded_message_until
 
 
 if __name__ == "__main__":
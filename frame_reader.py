@@ -0,0 +1,370 @@
+import os
+import sys
+import threading
+import numpy as np
+from collections import OrderedDict
+
+try:
+    import av
+except ImportError:  # Only FrameReader needs PyAV; the labeler can fall back to OpenCV
+    av = None
+
+try:
+    from av.codec.hwaccel import HWAccel
+except ImportError:  # PyAV < 14 has no hardware decoding API (or no PyAV at all)
+    HWAccel = None
+
+# Number of decoded frames kept in memory (~6 MB each at 1080p)
+FRAME_CACHE_SIZE = 64
+# Frames the background prefetcher keeps behind and decodes ahead of the frame on screen
+PREFETCH_BEHIND = 30
+PREFETCH_AHEAD = 30
+# Frames wider than this are scaled down for display (labeling never needs full 1080p/4K)
+DISPLAY_MAX_WIDTH = 1280
+# Hardware decoders to try per platform, in order of preference
+HWACCEL_DEVICE_TYPES = {
+    'darwin': ('videotoolbox',),
+    'linux': ('cuda', 'vaapi'),
+    'win32': ('d3d11va', 'cuda'),
+}
+
+
+def open_container(video_path):
+    """
+    Opens a video with hardware-accelerated decoding when the platform supports it.
+    Falls back to software decoding if no hardware decoder can be set up.
+    """
+    if HWAccel is not None:
+        for device_type in HWACCEL_DEVICE_TYPES.get(sys.platform, ()):
+            try:
+                hwaccel = HWAccel(device_type=device_type, allow_software_fallback=True)
+                return av.open(video_path, hwaccel=hwaccel)
+            except (av.error.FFmpegError, ValueError):
+                continue
+    return av.open(video_path)
+
+
+def load_frame_index(video_path, container, stream):
+    """
+    Returns the presentation timestamps of every frame and of every keyframe in the stream.
+    Built once by demuxing the file (packets only, nothing is decoded) and saved next to
+    the video as <video>.idx.npz, so later runs and other readers just load it.
+
+    Returns:
+        tuple: (frame_pts, keyframe_pts), both sorted int64 arrays.
+    """
+    index_path = video_path + '.idx.npz'
+    video_stat = os.stat(video_path)
+    signature = np.array([video_stat.st_size, video_stat.st_mtime_ns], dtype=np.int64)
+
+    if os.path.exists(index_path):
+        try:
+            with np.load(index_path) as index:
+                if np.array_equal(index['signature'], signature):
+                    return index['frame_pts'], index['keyframe_pts']
+        except Exception:
+            pass  # Unreadable or damaged index (e.g. a truncated write), rebuild it
+
+    frame_pts = []
+    keyframe_pts = []
+    for packet in container.demux(stream):
+        if packet.pts is None:
+            continue  # Flush packets at the end of the stream
+        if packet.is_discard:
+            continue  # Edit-list lead-in; the decoder never outputs these frames
+        frame_pts.append(packet.pts)
+        if packet.is_keyframe:
+            keyframe_pts.append(packet.pts)
+    container.seek(0)
+
+    # Packets come out in decode order; frames are numbered in presentation order
+    frame_pts = np.sort(np.array(frame_pts, dtype=np.int64))
+    keyframe_pts = np.sort(np.array(keyframe_pts, dtype=np.int64))
+
+    # Write to a temp file first so a crash or a concurrent reader never sees a partial index
+    temp_path = index_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            np.savez(f, signature=signature, frame_pts=frame_pts, keyframe_pts=keyframe_pts)
+        os.replace(temp_path, index_path)
+    except OSError:
+        pass  # Read-only location; the index is just rebuilt next time
+
+    return frame_pts, keyframe_pts
+
+
+def read_rotation(container, stream):
+    """
+    Returns how many quarter turns counterclockwise frames must be rotated for display,
+    from the display matrix of the first frame (phone and tablet recordings are often
+    stored sideways). OpenCV applies this automatically; PyAV's to_ndarray does not.
+    """
+    try:
+        rotation = getattr(next(container.decode(stream)), 'rotation', 0) or 0
+    except (StopIteration, av.error.FFmpegError):
+        rotation = 0
+    container.seek(0)
+    return int(round(rotation / 90)) % 4
+
+
+class FrameReader:
+    """
+    Reads video frames by index using PyAV.
+    Stepping forward continues decoding sequentially as long as no keyframe lies
+    before the target; any other jump seeks to the nearest preceding keyframe and
+    decodes forward from there.
+    Frames are numbered from their timestamps, round(t * fps), which is how OpenCV
+    numbers frames after a seek, so both backends (and CSVs made with either) agree
+    on variable frame rate files too. An index no frame's timestamp rounds to is
+    served by the next frame, and of frames sharing an index only the first is used.
+    Keyframe positions come from a packet index built once per video (see load_frame_index).
+    Recently decoded frames are kept in an LRU cache so revisiting them is free.
+    Frames wider than max_width are scaled down during colour conversion, and
+    rotated recordings are turned upright; width/height describe the frames as returned.
+    """
+
+    def __init__(self, video_path, cache_size=FRAME_CACHE_SIZE, max_width=DISPLAY_MAX_WIDTH):
+        if av is None:
+            raise ImportError("PyAV is not installed (pip3 install av)")
+        self.container = open_container(video_path)
+        self.stream = self.container.streams.video[0]
+        # Same rate OpenCV reports (av_guess_frame_rate), so frame numbers match its seeks
+        rate = self.stream.guessed_rate or self.stream.average_rate
+        if not rate:
+            raise ValueError(f"Could not determine the frame rate of '{video_path}'")
+        self.fps = float(rate)
+        self.time_base = self.stream.time_base
+        self.start_pts = self.stream.start_time or 0
+        self.frames_per_tick = float(self.time_base) * self.fps
+        self.frame_pts, self.keyframe_pts = load_frame_index(video_path, self.container, self.stream)
+
+        self.rotation = read_rotation(self.container, self.stream)
+        self.width = self.stream.width
+        self.height = self.stream.height
+        if self.rotation % 2:
+            self.width, self.height = self.height, self.width
+        if self.width > max_width:
+            self.height = int(self.height * max_width / self.width)
+            self.width = max_width
+        # Size frames are converted at, before rotating them upright
+        self.decode_width, self.decode_height = (self.height, self.width) if self.rotation % 2 else (self.width, self.height)
+        self.total_frames = self.pts_to_index(self.frame_pts[-1]) + 1 if len(self.frame_pts) else 0
+
+        self.frame_iter = None
+        self.decoder_index = None  # index of the frame the decoder last produced
+        self.last_index = None  # index of the frame last returned by read()
+        # Frame standing in for the indices from held_from up to decoder_index, which no
+        # frame's timestamp rounds to (only kept while the decoder is right after it)
+        self.held_from = None
+        self.held_image = None
+
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+    def index_to_pts(self, index):
+        return int(round(index / self.frames_per_tick)) + self.start_pts
+
+    def pts_to_index(self, pts):
+        return int(np.floor((pts - self.start_pts) * self.frames_per_tick + 0.5))
+
+    def keyframe_before(self, index):
+        # pts of the last keyframe whose frame number is at most index, or None
+        keyframe = np.searchsorted(self.keyframe_pts, self.index_to_pts(index + 0.5), side='left') - 1
+        return int(self.keyframe_pts[keyframe]) if keyframe >= 0 else None
+
+    def seek(self, index):
+        # Seek straight to the keyframe at or before the target
+        target_pts = self.keyframe_before(index)
+        if target_pts is None:
+            target_pts = self.index_to_pts(index)
+        self.container.seek(target_pts, stream=self.stream, any_frame=False, backward=True)
+        self.frame_iter = self.container.decode(self.stream)
+        self.decoder_index = None
+        self.held_image = None
+
+    def needs_seek(self, index):
+        """
+        Whether reaching index requires a seek. Decoding forward is never slower than
+        seeking while no keyframe lies between the decoder's position and the target,
+        so short forward jumps (e.g. +10) keep decoding without converting the frames in between.
+        """
+        if self.frame_iter is None or self.decoder_index is None or index <= self.decoder_index:
+            return True
+        if index == self.decoder_index + 1:
+            return False
+        keyframe_pts = self.keyframe_before(index)
+        return keyframe_pts is not None and self.pts_to_index(keyframe_pts) > self.decoder_index
+
+    def to_image(self, frame):
+        # Scaling happens in the same swscale pass as the YUV -> BGR conversion
+        image = frame.to_ndarray(width=self.decode_width, height=self.decode_height, format='bgr24')
+        if self.rotation:
+            # Contiguous copy so OpenCV can draw on it
+            image = np.ascontiguousarray(np.rot90(image, self.rotation))
+        return image
+
+    def is_decoded(self, index):
+        """
+        Whether read(index) can return without decoding (cached or standing in for a gap).
+        """
+        return index in self.cache or (self.held_image is not None and self.held_from <= index <= self.decoder_index)
+
+    def read(self, index, exact=True):
+        """
+        Returns (ret, frame) like cv2.VideoCapture.read(), with frame as a BGR ndarray.
+        With exact=False a seek snaps to the preceding keyframe instead of decoding
+        forward to the requested frame; last_index holds the index actually returned.
+        """
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            self.last_index = index
+            return True, self.cache[index].copy()
+
+        if self.held_image is not None and self.held_from <= index <= self.decoder_index:
+            self.last_index = index
+            return True, self.held_image.copy()
+
+        seeked = self.needs_seek(index)
+        if seeked:
+            self.seek(index)
+
+        # Decode forward, discarding frames that come before the target without converting them
+        # (only a seek with exact=False stops early, at the keyframe)
+        to_target = exact or not seeked
+        for frame in self.frame_iter:
+            if frame.pts is None:
+                continue
+            frame_index = self.pts_to_index(frame.pts)
+            if to_target and frame_index < index:
+                continue
+            self.decoder_index = frame_index
+            image = self.to_image(frame)
+            self.held_image = None
+            if not to_target:
+                index = frame_index
+            elif frame_index > index:
+                # No frame has a timestamp in index..frame_index - 1, so this one stands in for them
+                self.held_from, self.held_image = index, image.copy()
+            self.last_index = index
+            if self.cache_size:
+                self.cache[index] = image.copy()
+                self.cache.move_to_end(index)
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            return True, image
+
+        # Ran off the end of the stream
+        self.frame_iter = None
+        self.decoder_index = None
+        self.last_index = None
+        return False, None
+
+    def read_window(self, first_index, last_index, out=None):
+        """
+        Decodes frames first_index..last_index (inclusive) with a single seek.
+        If out is given, frames are decoded into its leading rows instead of a new array,
+        so callers can reuse one buffer across windows.
+
+        Returns:
+            tuple: (window, count) where window is an (N, H, W, 3) BGR array and
+            count is the number of leading frames that were actually decoded.
+        """
+        if out is None:
+            window = np.empty((last_index - first_index + 1, self.height, self.width, 3), dtype=np.uint8)
+        else:
+            window = out[:last_index - first_index + 1]
+        count = 0
+
+        self.seek(first_index)
+        for frame in self.frame_iter:
+            if frame.pts is None:
+                continue
+            frame_index = self.pts_to_index(frame.pts)
+            if frame_index < first_index + count:
+                continue  # Before the window, or sharing an index with the previous frame
+            # The frame also fills any indices before it that no frame's timestamp rounds to
+            end = min(frame_index, last_index) - first_index + 1
+            window[count:end] = self.to_image(frame)
+            count = end
+            self.decoder_index = frame_index
+            if frame_index >= last_index:
+                if frame_index > last_index:
+                    # That frame has been consumed, so the next read must seek
+                    self.decoder_index = None
+                break
+
+        return window, count
+
+    def close(self):
+        self.container.close()
+
+
+class FramePrefetcher:
+    """
+    Decodes frames on a background thread around the frame being shown.
+    read_frame(index) -> (ret, frame) is only ever called from the worker thread, so the
+    underlying decoder is never shared between threads. Frames from `behind` before the
+    current one to `ahead` after it are kept; everything else is evicted.
+    """
+
+    def __init__(self, read_frame, total_frames, behind=PREFETCH_BEHIND, ahead=PREFETCH_AHEAD):
+        self.read_frame = read_frame
+        self.total_frames = total_frames
+        self.behind = behind
+        self.ahead = ahead
+
+        self.frames = {}  # frame index -> frame, or None if it could not be read
+        self.target = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def next_missing(self):
+        # First frame from the target onwards that hasn't been decoded yet (lock held)
+        last = min(self.target + self.ahead, self.total_frames - 1)
+        for index in range(self.target, last + 1):
+            if index not in self.frames:
+                return index
+        return None
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and self.next_missing() is None:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                index = self.next_missing()
+
+            try:
+                ret, frame = self.read_frame(index)
+            except Exception as e:
+                print(f"Warning: Could not decode frame {index}: {e}")
+                ret, frame = False, None
+
+            with self.condition:
+                if self.target - self.behind <= index <= self.target + self.ahead:
+                    self.frames[index] = frame if ret else None
+                self.condition.notify_all()
+
+    def get(self, index):
+        """
+        Returns (ret, frame) for the given index, waiting for the worker if it hasn't
+        been decoded yet. The returned frame is shared with the cache; copy before drawing.
+        """
+        with self.condition:
+            self.target = index
+            for cached in [i for i in self.frames if not index - self.behind <= i <= index + self.ahead]:
+                del self.frames[cached]
+            self.condition.notify_all()
+            while index not in self.frames and index < self.total_frames and not self.stopped:
+                self.condition.wait()
+            frame = self.frames.get(index)
+        return frame is not None, frame
+
+    def close(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()